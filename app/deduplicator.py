@@ -6,320 +6,684 @@ CSV Deduplication Engine
 """
 
 import csv
+import gzip
 import io
-import re
+import os
+import zlib
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from rapidfuzz import fuzz
+from typing import BinaryIO, Callable, Iterator, NamedTuple, Sequence
+
+import numpy as np
+from numba import njit
+from rapidfuzz import fuzz, process
+
+from .deduplicator_hot import (
+    COLUMN_WEIGHTS,
+    ColumnMap,
+    build_column_map,
+    clear_email_cache,
+    format_csv,
+    get_all_emails,
+    get_company_field,
+    get_name_field,
+    normalize_name,
+    signatures_from_emails,
+)
+
+
+# MinHash LSH blocking: 64 permutations split into 32 bands of 2 rows.
+# Names sharing any band land in the same bucket; the low (~18% 3-gram
+# Jaccard) threshold keeps one-letter typos like "smith"/"smyth" together.
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 32
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+_MINHASH_PRIME = np.uint64((1 << 31) - 1)
+_minhash_rng = np.random.default_rng(42)
+_MINHASH_A = _minhash_rng.integers(1, _MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_MINHASH_B = _minhash_rng.integers(0, _MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+# Names are permuted in batches of this many when computing signatures
+MINHASH_BATCH = 4096
+# Candidate pairs buffered (and scored) per batch
+LSH_PAIR_CHUNK = 1 << 22
+# LSH buckets at least this large are scored whole with cdist rather
+# than expanded into candidate pairs
+LSH_PAIR_BUCKET_LIMIT = 32
+# Name buckets at least this large are scored by cdist on SCORING_THREADS
+PARALLEL_BUCKET_SIZE = 256
+# Candidate pairs per thread below which scoring isn't split across threads
+PARALLEL_PAIR_SLICE = 1 << 14
+# Threads used to score one upload; see set_scoring_threads
+SCORING_THREADS = os.cpu_count() or 1
+# Max score matrix cells (uint8) held at once when scoring a bucket
+BUCKET_SLICE_CELLS = 1 << 22
+
+
+def set_scoring_threads(threads: int) -> None:
+    """
+    Set how many threads score the name candidates of one upload. Worker
+    processes that already run one upload per core should use 1.
+    """
+    global SCORING_THREADS
+    SCORING_THREADS = max(1, threads)
 
 
 @dataclass
 class DuplicateGroup:
     """A group of records that are potential duplicates."""
-    master_record: dict
-    duplicates: list[dict]
+    master_record: tuple[str, ...]
+    duplicates: list[tuple[str, ...]]
     merge_type: str  # 'auto' or 'flagged'
     reason: str
-    merged_data: dict = field(default_factory=dict)
+    merged_data: list[str] = field(default_factory=list)
+
 
+class RecordFeatures(NamedTuple):
+    """Per-record values used for matching and reporting, computed once up front."""
+    name: str
+    norm: str
+    email: str  # first email, for the summary
+    company: str
+    company_lower: str
+    sig_ids: frozenset[int]
+    score: int
 
-def normalize_name(name: str) -> str:
-    """Normalize a name for comparison."""
-    if not name:
-        return ""
-    return " ".join(name.lower().strip().split())
 
+def score_completeness(records: list[tuple[str, ...]], cols: ColumnMap) -> np.ndarray:
+    """Score every record based on data completeness. Higher = more complete."""
+    scores = np.zeros(len(records), dtype=np.int32)
+    for idx, kind in enumerate(cols.kinds):
+        nonempty = np.fromiter((bool(r[idx]) for r in records), dtype=bool, count=len(records))
+        scores += COLUMN_WEIGHTS[kind] * nonempty
+    return scores
 
-def extract_email_parts(email: str) -> tuple[str, str]:
+
+def match_name_bucket(names: Sequence[str], threshold: int = 85, workers: int = -1) -> list[tuple[int, int]]:
     """
-    Extract username and domain base from email.
-    nacho@google.com -> ('nacho', 'google')
-    nacho@google.es -> ('nacho', 'google')
-    nacho@mail.google.co.uk -> ('nacho', 'google')
+    Find fuzzy-matching pairs within a bucket of normalized names.
+    Scores the bucket with cdist in row slices of uint8 scores, so a
+    large bucket never holds more than BUCKET_SLICE_CELLS bytes of
+    scores; the score cutoff lets cdist stop early on non-matches.
+    Returns (a, b) positions with a < b. Names shorter than 10 chars
+    need 95 instead of threshold, so "Person 1" doesn't match "Person 10".
     """
-    if not email or "@" not in email:
-        return ("", "")
-
-    parts = email.lower().strip().split("@")
-    if len(parts) != 2:
-        return ("", "")
+    if len(names) < 2:
+        return []
+    pairs = []
+    step = max(1, BUCKET_SLICE_CELLS // len(names))
+    for start in range(0, len(names), step):
+        scores = process.cdist(
+            names[start:start + step], names,
+            scorer=fuzz.ratio, score_cutoff=threshold, dtype=np.uint8, workers=workers
+        )
+        rows, cols = np.nonzero(scores)
+        matched = scores[rows, cols].tolist()
+        for a, b, score in zip((rows + start).tolist(), cols.tolist(), matched):
+            if a >= b:
+                continue
+            n1, n2 = names[a], names[b]
+            # uint8 scores are rounded (94.7 -> 95), so recheck borderline
+            # short-name pairs exactly
+            if n1 != n2 and min(len(n1), len(n2)) < 10 and (score < 95 or (score == 95 and fuzz.ratio(n1, n2) < 95)):
+                continue
+            pairs.append((a, b))
+    return pairs
 
-    username = parts[0]
-    domain = parts[1]
 
-    # Remove TLD and extract main domain
-    # google.com -> google
-    # google.co.uk -> google
-    # mail.google.com -> google
-    domain_parts = domain.split(".")
+def merge_records(
+    master: tuple[str, ...], duplicates: list[tuple[str, ...]], cols: ColumnMap
+) -> list[str]:
+    """Merge data from duplicates into master record."""
+    merged = list(master)
+    for idx, value in enumerate(merged):
+        if value:
+            continue
+        for dup in duplicates:
+            if dup[idx]:
+                merged[idx] = dup[idx]
+                break
 
-    # Filter out common TLDs and subdomains
-    tlds = {'com', 'es', 'uk', 'de', 'fr', 'it', 'nl', 'be', 'org', 'net', 'io', 'co', 'ai', 'app'}
-    subdomains = {'mail', 'email', 'smtp', 'www'}
+    # Merge email addresses
+    master_emails = set(get_all_emails(master, cols))
+    for dup in duplicates:
+        master_emails.update(get_all_emails(dup, cols))
 
-    # Get the main domain part
-    main_parts = [p for p in domain_parts if p not in tlds and p not in subdomains]
-    domain_base = main_parts[0] if main_parts else domain_parts[0]
+    if master_emails:
+        email_value = ", ".join(sorted(master_emails))
+        for idx in cols.email_cols:
+            merged[idx] = email_value
 
-    return (username, domain_base)
+    return merged
 
 
-def get_all_emails(record: dict) -> list[str]:
-    """Extract all email addresses from a record."""
-    emails = []
-    for key, value in record.items():
-        if not value:
-            continue
-        key_lower = key.lower()
-        if 'email' in key_lower:
-            if isinstance(value, str) and "@" in value:
-                emails.append(value.lower().strip())
-            elif isinstance(value, list):
-                for v in value:
-                    if isinstance(v, str) and "@" in v:
-                        emails.append(v.lower().strip())
-    return emails
-
-
-def get_email_signatures(record: dict) -> set[str]:
-    """
-    Get email signatures (username+domain) for matching.
-    Returns set of 'username:domain' strings.
-    """
-    emails = get_all_emails(record)
-    signatures = set()
-    for email in emails:
-        username, domain = extract_email_parts(email)
-        if username and domain:
-            signatures.add(f"{username}:{domain}")
+def minhash_signatures(names: Sequence[str]) -> np.ndarray:
+    """
+    Compute MinHash signatures over the character 3-grams of normalized
+    names, one row per name.
+    """
+    grams = [{name[k:k + 3] for k in range(len(name) - 2)} or {name} for name in names]
+    counts = np.fromiter(map(len, grams), dtype=np.int64, count=len(grams))
+    hashes = np.fromiter(
+        (zlib.crc32(g.encode()) for name_grams in grams for g in name_grams),
+        dtype=np.uint64, count=int(counts.sum())
+    )
+    # Keep hashes below the prime so a * x stays inside uint64
+    hashes %= _MINHASH_PRIME
+    starts = np.concatenate(([0], np.cumsum(counts)))
+
+    # Permute batches of names so the (grams x permutations) matrix stays small
+    signatures = np.empty((len(names), MINHASH_PERMUTATIONS), dtype=np.uint64)
+    for lo in range(0, len(names), MINHASH_BATCH):
+        hi = min(lo + MINHASH_BATCH, len(names))
+        batch = hashes[starts[lo]:starts[hi], None]
+        permuted = (batch * _MINHASH_A + _MINHASH_B) % _MINHASH_PRIME
+        signatures[lo:hi] = np.minimum.reduceat(permuted, starts[lo:hi] - starts[lo], axis=0)
     return signatures
 
 
-def get_name_field(record: dict) -> str:
-    """Find and return the name field from a record."""
-    name_keys = ['name', 'full_name', 'fullname', 'contact_name', 'person_name']
-    for key in record.keys():
-        if key.lower() in name_keys:
-            return str(record[key] or "")
-    # Try to combine first + last name
-    first = ""
-    last = ""
-    for key in record.keys():
-        key_lower = key.lower()
-        if 'first' in key_lower and 'name' in key_lower:
-            first = str(record[key] or "")
-        elif 'last' in key_lower and 'name' in key_lower:
-            last = str(record[key] or "")
-    if first or last:
-        return f"{first} {last}".strip()
-    return ""
-
-
-def get_company_field(record: dict) -> str:
-    """Find and return the company field from a record."""
-    company_keys = ['company', 'company_name', 'organization', 'org', 'employer']
-    for key in record.keys():
-        if key.lower() in company_keys:
-            return str(record[key] or "").strip()
-    return ""
-
-
-def score_record_completeness(record: dict) -> int:
-    """Score a record based on data completeness. Higher = more complete."""
-    score = 0
-    for key, value in record.items():
-        if not value:
-            continue
-        key_lower = key.lower()
-        if 'email' in key_lower:
-            score += 10
-        elif 'phone' in key_lower or 'mobile' in key_lower:
-            score += 5
-        elif 'company' in key_lower or 'organization' in key_lower:
-            score += 5
-        elif 'title' in key_lower or 'job' in key_lower or 'position' in key_lower:
-            score += 3
-        elif 'linkedin' in key_lower:
-            score += 2
-        elif 'address' in key_lower or 'location' in key_lower:
-            score += 2
-        elif value:
-            score += 1
-    return score
-
-
-def names_match(name1: str, name2: str, threshold: int = 85) -> bool:
-    """Check if two names match using fuzzy matching."""
-    n1 = normalize_name(name1)
-    n2 = normalize_name(name2)
-    if not n1 or not n2:
-        return False
-    if n1 == n2:
-        return True
-    # For short names, require higher similarity to avoid false positives
-    # "Person 1" vs "Person 10" would wrongly match at 80%
-    min_len = min(len(n1), len(n2))
-    if min_len < 10:
-        threshold = 95  # Very strict for short names
-    ratio = fuzz.ratio(n1, n2)
-    return ratio >= threshold
-
-
-def emails_match(record1: dict, record2: dict) -> bool:
-    """
-    Check if two records have matching emails.
-    Matches if same username AND same domain base (ignoring TLD).
-    nacho@google.com matches nacho@google.es
-    nacho@google.com does NOT match nacho@microsoft.com
-    """
-    sigs1 = get_email_signatures(record1)
-    sigs2 = get_email_signatures(record2)
-    if not sigs1 or not sigs2:
-        return False
-    return bool(sigs1 & sigs2)
-
-
-def merge_records(master: dict, duplicates: list[dict]) -> dict:
-    """Merge data from duplicates into master record."""
-    merged = {}
-    for key in master.keys():
-        master_value = master.get(key)
-        if master_value:
-            merged[key] = master_value
+def lsh_candidates(signatures: np.ndarray) -> tuple[np.ndarray, list[np.ndarray]]:
+    """
+    Bucket names by LSH band and return the candidate pairs: i * n + j
+    codes (i < j) for buckets smaller than LSH_PAIR_BUCKET_LIMIT, and the
+    larger buckets as ascending name index arrays, to be scored whole.
+    """
+    n = len(signatures)
+    candidates = np.empty(0, dtype=np.int64)
+    pair_chunks = []
+    pending = 0
+    large_buckets = {}
+    band_dtype = np.dtype((np.void, signatures.itemsize * LSH_ROWS))
+    for band in range(LSH_BANDS):
+        # Each band's rows viewed as one opaque key per name
+        keys = np.ascontiguousarray(signatures[:, band * LSH_ROWS:(band + 1) * LSH_ROWS]).view(band_dtype).ravel()
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        run_starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+        run_sizes = np.diff(np.append(run_starts, n))
+        for size in np.unique(run_sizes[run_sizes > 1]).tolist():
+            starts = run_starts[run_sizes == size]
+            if size >= LSH_PAIR_BUCKET_LIMIT:
+                for start in starts.tolist():
+                    bucket = order[start:start + size]
+                    large_buckets.setdefault(bucket.tobytes(), bucket)
+                continue
+            # The stable sort keeps each bucket ascending, so a < b gives i < j
+            a, b = np.triu_indices(size, k=1)
+            pair_chunks.append((order[starts[:, None] + a] * n + order[starts[:, None] + b]).ravel())
+            pending += len(pair_chunks[-1])
+        # Bands repeat most pairs; fold them in as we go to bound memory
+        if pending >= LSH_PAIR_CHUNK or band == LSH_BANDS - 1:
+            candidates = np.unique(np.concatenate([candidates, *pair_chunks]))
+            pair_chunks = []
+            pending = 0
+    return candidates, list(large_buckets.values())
+
+
+@njit(cache=True)
+def popcount64(x: np.uint64) -> np.uint64:
+    """Number of set bits in x."""
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+@njit(cache=True, nogil=True)
+def indel_within(
+    chars: np.ndarray, n_chars: int, offsets: np.ndarray,
+    left: np.ndarray, right: np.ndarray, max_dist: np.ndarray
+) -> np.ndarray:
+    """
+    Whether the Indel distance (the distance behind fuzz.ratio) of each
+    left/right pair of strings is at most max_dist. Strings are given as
+    dense char ids with per-string offsets; pairs should be sorted by
+    left string.
+
+    Left strings of up to 64 chars use the bit-parallel LCS of Hyyro,
+    one word operation per char of the right string. Longer ones fall
+    back to a DP that stops as soon as the rows left can no longer bring
+    the pair within its bound.
+    """
+    all_ones = np.uint64(0xFFFFFFFFFFFFFFFF)
+    # Bit i of masks[c] is set when char i of the current left string is c
+    masks = np.zeros(n_chars, dtype=np.uint64)
+    masked = -1
+    max_len = 0
+    for k in range(len(offsets) - 1):
+        max_len = max(max_len, offsets[k + 1] - offsets[k])
+    row = np.zeros(max_len + 1, dtype=np.int64)
+    out = np.zeros(len(left), dtype=np.bool_)
+    for p in range(len(left)):
+        start1, end1 = offsets[left[p]], offsets[left[p] + 1]
+        start2, end2 = offsets[right[p]], offsets[right[p] + 1]
+        len1, len2 = end1 - start1, end2 - start2
+        # distance = len1 + len2 - 2 * LCS
+        needed = (len1 + len2 - max_dist[p] + 1) // 2
+
+        if len1 <= 64:
+            if masked != left[p]:
+                if masked >= 0:
+                    for i in range(offsets[masked], offsets[masked + 1]):
+                        masks[chars[i]] = 0
+                bit = np.uint64(1)
+                for i in range(start1, end1):
+                    masks[chars[i]] |= bit
+                    bit <<= np.uint64(1)
+                masked = left[p]
+            v = all_ones
+            for j in range(start2, end2):
+                u = v & masks[chars[j]]
+                v = (v + u) | (v - u)
+            lcs = popcount64(~v & (all_ones >> np.uint64(64 - len1)))
+            out[p] = lcs >= needed
             continue
-        for dup in duplicates:
-            dup_value = dup.get(key)
-            if dup_value:
-                merged[key] = dup_value
+
+        row[:len2 + 1] = 0
+        # Longest common subsequence, one DP row at a time
+        for i in range(start1, end1):
+            c = chars[i]
+            diag = 0
+            for j in range(len2):
+                up = row[j + 1]
+                if chars[start2 + j] == c:
+                    row[j + 1] = diag + 1
+                elif row[j] > up:
+                    row[j + 1] = row[j]
+                diag = up
+            if row[len2] + (end1 - i - 1) < needed:
                 break
-        if key not in merged:
-            merged[key] = master_value
+        out[p] = row[len2] >= needed
+    return out
 
-    # Merge email addresses
-    master_emails = set(get_all_emails(master))
-    for dup in duplicates:
-        master_emails.update(get_all_emails(dup))
 
-    for key in master.keys():
-        if 'email' in key.lower() and master_emails:
-            merged[key] = list(master_emails)[0] if len(master_emails) == 1 else ", ".join(sorted(master_emails))
+def score_pairs(
+    chars: np.ndarray, n_chars: int, offsets: np.ndarray,
+    left: np.ndarray, right: np.ndarray, max_dist: np.ndarray
+) -> np.ndarray:
+    """
+    indel_within over pairs sorted by left string, split into contiguous
+    slices on SCORING_THREADS threads; the kernel releases the GIL.
+    """
+    slices = min(SCORING_THREADS, len(left) // PARALLEL_PAIR_SLICE)
+    if slices <= 1:
+        return indel_within(chars, n_chars, offsets, left, right, max_dist)
+    bounds = np.linspace(0, len(left), slices + 1).astype(np.int64).tolist()
 
-    return merged
+    def score_slice(lo: int, hi: int) -> np.ndarray:
+        return indel_within(chars, n_chars, offsets, left[lo:hi], right[lo:hi], max_dist[lo:hi])
 
+    with ThreadPoolExecutor(max_workers=slices) as executor:
+        return np.concatenate(list(executor.map(score_slice, bounds[:-1], bounds[1:])))
 
-def find_duplicates(records: list[dict]) -> tuple[list[DuplicateGroup], list[dict]]:
-    """Find duplicate records in the dataset."""
-    if not records:
-        return [], []
 
-    processed = set()
-    duplicate_groups = []
-    clean_records = []
+def match_names(names: Sequence[str], threshold: int = 85) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find fuzzy-matching pairs among distinct normalized names, blocked
+    with MinHash LSH. Returns the (i, j) name indices of each match.
+    Candidates from small buckets are deduplicated across bands and
+    scored in one batch; large buckets go through match_name_bucket.
+    Both are split over SCORING_THREADS threads.
+    """
+    if len(names) < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    n = len(names)
+    pair_codes, large_buckets = lsh_candidates(minhash_signatures(names))
+
+    lengths = np.fromiter(map(len, names), dtype=np.int64, count=n)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    # Dense ids for the code points, so the kernel can index masks by char
+    codes = np.frombuffer("".join(names).encode("utf-32-le"), dtype=np.uint32)
+    char_set, chars = np.unique(codes, return_inverse=True)
+
+    matches = [pair_codes[:0]]
+    for lo in range(0, len(pair_codes), LSH_PAIR_CHUNK):
+        chunk = pair_codes[lo:lo + LSH_PAIR_CHUNK]
+        left, right = chunk // n, chunk % n
+        len_left, len_right = lengths[left], lengths[right]
+        # fuzz.ratio >= t  <=>  distance <= (len1 + len2) * (100 - t) // 100;
+        # names are distinct, so short pairs always need 95
+        pair_threshold = np.where(np.minimum(len_left, len_right) < 10, 95, threshold)
+        max_dist = (len_left + len_right) * (100 - pair_threshold) // 100
+        # The length gap alone is a lower bound on the distance
+        close = np.abs(len_left - len_right) <= max_dist
+        chunk, left, right, max_dist = chunk[close], left[close], right[close], max_dist[close]
+        matches.append(chunk[score_pairs(chars, len(char_set), offsets, left, right, max_dist)])
+
+    def score_buckets(buckets: list[np.ndarray], workers: int = 1) -> list[np.ndarray]:
+        scored = []
+        for bucket in buckets:
+            pairs = match_name_bucket([names[k] for k in bucket.tolist()], threshold, workers=workers)
+            if pairs:
+                a, b = np.asarray(pairs, dtype=np.int64).T
+                scored.append(bucket[a] * n + bucket[b])
+        return scored
+
+    # Big buckets spread cdist itself over the threads; the rest are dealt
+    # out to the threads in turn (cdist releases the GIL while scoring)
+    matches.extend(score_buckets([b for b in large_buckets if len(b) >= PARALLEL_BUCKET_SIZE], SCORING_THREADS))
+    small_buckets = [b for b in large_buckets if len(b) < PARALLEL_BUCKET_SIZE]
+    threads = min(SCORING_THREADS, len(small_buckets))
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for scored in executor.map(score_buckets, [small_buckets[k::threads] for k in range(threads)]):
+                matches.extend(scored)
+    else:
+        matches.extend(score_buckets(small_buckets))
+
+    matched = np.unique(np.concatenate(matches))
+    return matched // n, matched % n
+
+
+def build_features(
+    record: tuple[str, ...], cols: ColumnMap, score: int, sig_ids: dict[str, int]
+) -> RecordFeatures:
+    """
+    Extract the matching features of a record in a single pass.
+    Email signatures are interned through sig_ids so later set
+    operations hash small ints instead of strings.
+    """
+    name = get_name_field(record, cols)
+    emails = get_all_emails(record, cols)
+    company = get_company_field(record, cols)
+    return RecordFeatures(
+        name=name,
+        norm=normalize_name(name),
+        email=emails[0] if emails else '',
+        company=company,
+        company_lower=company.lower(),
+        sig_ids=frozenset(sig_ids.setdefault(sig, len(sig_ids)) for sig in signatures_from_emails(emails)),
+        score=score
+    )
+
+
+def key_group_pairs(ids: list[int], company_ids: np.ndarray, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Link an ascending id list of rows sharing a key (a name or an email
+    signature) as i * n + j codes, without expanding it into every pair.
+    Each row is linked to the first row of its company (a star), and the
+    first rows of the companies, including no company, to each other.
+    Returns the codes and those first rows.
+    """
+    arr = np.asarray(ids, dtype=np.int64)
+    _, first, inverse = np.unique(company_ids[arr], return_index=True, return_inverse=True)
+    reps = arr[first]
+    # ids are ascending, so each row's company rep comes first
+    hubs = reps[inverse]
+    star = hubs[hubs != arr] * n + arr[hubs != arr]
+    a, b = np.triu_indices(len(reps), k=1)
+    return np.concatenate([star, np.minimum(reps[a], reps[b]) * n + np.maximum(reps[a], reps[b])]), reps
 
-    # Build candidate buckets
-    candidates = defaultdict(list)
 
-    for i, record in enumerate(records):
-        name = normalize_name(get_name_field(record))
-        if name:
-            bucket_key = name[:3] if len(name) >= 3 else name
-            candidates[bucket_key].append(i)
+def cross_pairs(ids_a: np.ndarray, ids_b: np.ndarray, n: int) -> np.ndarray:
+    """Encode every (a, b) pair across two id arrays as min * n + max codes."""
+    left, right = np.meshgrid(ids_a, ids_b)
+    return (np.minimum(left, right) * n + np.maximum(left, right)).ravel()
 
-        for sig in get_email_signatures(record):
-            candidates[f"email:{sig}"].append(i)
 
-    for i, record in enumerate(records):
-        if i in processed:
-            continue
+# Outcome of each auto-merge edge in cluster_auto_edges
+EDGE_SKIPPED = 0  # both rows were already in the same cluster
+EDGE_MERGED = 1
+EDGE_CONFLICT = 2  # clusters belong to different companies
+
+
+@njit(cache=True)
+def dsu_find(parent: np.ndarray, i: int) -> int:
+    """Find the cluster root of i, halving the path as it goes."""
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
 
-        record_name = get_name_field(record)
-        record_company = get_company_field(record)
+@njit(cache=True)
+def cluster_auto_edges(
+    n: int, edge_i: np.ndarray, edge_j: np.ndarray, company_ids: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Union auto-merge edges in order, refusing any union that would put two
+    different companies (non-zero company ids) in one cluster.
+    Returns each row's root, each edge's outcome, and for conflicts the
+    company ids of the two clusters at the time.
+    """
+    parent = np.arange(n)
+    company = company_ids.copy()
+    status = np.zeros(len(edge_i), dtype=np.int8)
+    conflict_a = np.zeros(len(edge_i), dtype=np.int32)
+    conflict_b = np.zeros(len(edge_i), dtype=np.int32)
+    for e in range(len(edge_i)):
+        root_i = dsu_find(parent, edge_i[e])
+        root_j = dsu_find(parent, edge_j[e])
+        if root_i == root_j:
+            continue
+        company_i, company_j = company[root_i], company[root_j]
+        if company_i != 0 and company_j != 0 and company_i != company_j:
+            status[e] = EDGE_CONFLICT
+            conflict_a[e] = company_i
+            conflict_b[e] = company_j
+            continue
+        root = min(root_i, root_j)
+        parent[max(root_i, root_j)] = root
+        company[root] = company_i if company_i != 0 else company_j
+        status[e] = EDGE_MERGED
+    for i in range(n):
+        parent[i] = dsu_find(parent, i)
+    return parent, status, conflict_a, conflict_b
 
-        potential_matches = set()
-        name_normalized = normalize_name(record_name)
 
-        if name_normalized:
-            bucket_key = name_normalized[:3] if len(name_normalized) >= 3 else name_normalized
-            for j in candidates.get(bucket_key, []):
-                if j != i and j not in processed:
-                    potential_matches.add(j)
+GroupCallback = Callable[[DuplicateGroup, RecordFeatures, list[RecordFeatures]], None]
 
-        for sig in get_email_signatures(record):
-            for j in candidates.get(f"email:{sig}", []):
-                if j != i and j not in processed:
-                    potential_matches.add(j)
 
-        auto_merge = []
-        flagged = []
+def find_duplicates(
+    records: list[tuple[str, ...]], cols: ColumnMap, on_group: GroupCallback | None = None
+) -> tuple[list[DuplicateGroup], list[tuple[str, ...]]]:
+    """
+    Find duplicate records in the dataset.
+    on_group, if given, is called as each group is formed with the
+    features of its master and duplicates, so callers can build their
+    outputs without walking the groups again.
+    """
+    if not records:
+        return [], []
 
-        for j in potential_matches:
-            other = records[j]
-            other_name = get_name_field(other)
-            other_company = get_company_field(other)
+    duplicate_groups = []
 
-            name_matches = names_match(record_name, other_name)
-            email_matches = emails_match(record, other)
+    scores = score_completeness(records, cols)
+    sig_ids = {}
+    features = [build_features(record, cols, score, sig_ids) for record, score in zip(records, scores.tolist())]
+
+    # Collapse exact duplicates (same name, email signatures and company) onto
+    # their most complete row; only these representatives go through the
+    # fuzzy pass and the collapsed rows rejoin them as auto-merge edges
+    n = len(records)
+    exact_groups = defaultdict(list)
+    for i, feat in enumerate(features):
+        if feat.norm or feat.sig_ids:
+            exact_groups[(feat.norm, feat.sig_ids, feat.company_lower)].append(i)
+
+    is_representative = [True] * n
+    collapsed_i, collapsed_j = [], []
+    for ids in exact_groups.values():
+        if len(ids) < 2:
+            continue
+        rep = ids[int(scores[ids].argmax())]
+        for k in ids:
+            if k != rep:
+                is_representative[k] = False
+                collapsed_i.append(min(k, rep))
+                collapsed_j.append(max(k, rep))
+
+    # Inverted indexes: representatives per distinct name and per email signature
+    name_records = defaultdict(list)
+    email_index = defaultdict(list)
+
+    for i, feat in enumerate(features):
+        if not is_representative[i]:
+            continue
+        if feat.norm:
+            name_records[feat.norm].append(i)
+
+        for sig_id in feat.sig_ids:
+            email_index[sig_id].append(i)
+
+    # Fuzzy-match the distinct names, blocked with MinHash LSH
+    names = list(name_records)
+    name_ids = list(name_records.values())
+    match_i, match_j = match_names(names)
+
+    # Intern companies case-insensitively; 0 means no company
+    company_index = {"": 0}
+    company_names = [""]
+    company_ids = np.empty(n, dtype=np.int32)
+    for i, feat in enumerate(features):
+        company_id = company_index.get(feat.company_lower)
+        if company_id is None:
+            company_id = company_index[feat.company_lower] = len(company_names)
+            company_names.append(feat.company)
+        company_ids[i] = company_id
+
+    # Collect matching pairs (i < j) as i * n + j codes, deduplicated in numpy.
+    # Rows sharing a key are linked per company rather than pairwise, so a
+    # placeholder name or shared mailbox on k rows costs O(k), not O(k^2)
+    pair_chunks = [np.empty(0, dtype=np.int64)]
+    for ids in email_index.values():
+        if len(ids) > 1:
+            pair_chunks.append(key_group_pairs(ids, company_ids, n)[0])
+
+    name_reps = []
+    for ids in name_ids:
+        if len(ids) > 1:
+            codes, reps = key_group_pairs(ids, company_ids, n)
+            pair_chunks.append(codes)
+            name_reps.append(reps)
+        else:
+            name_reps.append(np.asarray(ids, dtype=np.int64))
+
+    # Most names belong to a single record; link those matches in bulk
+    single = np.fromiter((ids[0] if len(ids) == 1 else -1 for ids in name_ids), dtype=np.int64, count=len(name_ids))
+    rec_i, rec_j = single[match_i], single[match_j]
+    both_single = (rec_i >= 0) & (rec_j >= 0)
+    pair_chunks.append(
+        np.minimum(rec_i[both_single], rec_j[both_single]) * n + np.maximum(rec_i[both_single], rec_j[both_single])
+    )
+    # Every row of a name is already linked to its company's rep
+    for a, b in zip(match_i[~both_single].tolist(), match_j[~both_single].tolist()):
+        pair_chunks.append(cross_pairs(name_reps[a], name_reps[b], n))
+
+    pair_codes = np.unique(np.concatenate(pair_chunks))
+
+    # Split pairs by whether they can be auto-merged
+    pair_i, pair_j = pair_codes // n, pair_codes % n
+    company_i, company_j = company_ids[pair_i], company_ids[pair_j]
+    no_company = (company_i == 0) | (company_j == 0)
+    same_company = ~no_company & (company_i == company_j)
+    conflict = ~no_company & ~same_company
+
+    # Cluster auto-merge edges transitively: collapsed exact duplicates and
+    # same-company links first. A link that would put two different
+    # companies in one cluster (e.g. through a record with no company) is
+    # sent to review instead.
+    collapsed_i = np.asarray(collapsed_i, dtype=np.int64)
+    collapsed_j = np.asarray(collapsed_j, dtype=np.int64)
+    edge_i = np.concatenate([collapsed_i, pair_i[same_company], pair_i[no_company]])
+    edge_j = np.concatenate([collapsed_j, pair_j[same_company], pair_j[no_company]])
+    edge_same = np.concatenate([
+        company_ids[collapsed_i] != 0,
+        np.ones(int(same_company.sum()), dtype=bool),
+        np.zeros(int(no_company.sum()), dtype=bool),
+    ])
+    parent, status, conflict_a, conflict_b = cluster_auto_edges(n, edge_i, edge_j, company_ids)
+
+    # Company conflicts: the direct pairs, then the unions refused above.
+    # Reasons are only formatted for the conflicts that become review groups
+    refused = np.flatnonzero(status == EDGE_CONFLICT)
+    n_direct = int(conflict.sum())
+    flag_i = np.concatenate([pair_i[conflict], edge_i[refused]])
+    flag_j = np.concatenate([pair_j[conflict], edge_j[refused]])
+    flag_a = np.concatenate([company_ids[pair_i[conflict]], conflict_a[refused]])
+    flag_b = np.concatenate([company_ids[pair_j[conflict]], conflict_b[refused]])
+
+    # Each cluster keeps the reason of the first edge merged into it
+    merged = np.flatnonzero(status == EDGE_MERGED)
+    roots, first = np.unique(parent[edge_i[merged]], return_index=True)
+    cluster_reasons = {
+        root: "Same company" if same else "No company on one/both"
+        for root, same in zip(roots.tolist(), edge_same[merged[first]].tolist())
+    }
 
-            if not name_matches and not email_matches:
-                continue
+    clusters = defaultdict(list)
+    for i, root in enumerate(parent.tolist()):
+        clusters[root].append(i)
 
-            if not record_company or not other_company:
-                auto_merge.append((j, "No company on one/both"))
-            elif record_company.lower() == other_company.lower():
-                auto_merge.append((j, "Same company"))
-            else:
-                flagged.append((j, f"Different companies: {record_company} vs {other_company}"))
-
-        if auto_merge or flagged:
-            if auto_merge:
-                all_in_group = [record] + [records[j] for j, _ in auto_merge]
-                scored = [(score_record_completeness(r), idx, r) for idx, r in enumerate(all_in_group)]
-                scored.sort(reverse=True)
-                master = scored[0][2]
-                dups = [r for _, idx, r in scored[1:]]
-
-                merged_data = merge_records(master, dups)
-
-                duplicate_groups.append(DuplicateGroup(
-                    master_record=master,
-                    duplicates=dups,
-                    merge_type='auto',
-                    reason=auto_merge[0][1],
-                    merged_data=merged_data
-                ))
-
-                processed.add(i)
-                for j, _ in auto_merge:
-                    processed.add(j)
-
-            if flagged:
-                for j, reason in flagged:
-                    if j not in processed:
-                        other = records[j]
-                        if score_record_completeness(record) >= score_record_completeness(other):
-                            master, dup = record, other
-                        else:
-                            master, dup = other, record
-
-                        duplicate_groups.append(DuplicateGroup(
-                            master_record=master,
-                            duplicates=[dup],
-                            merge_type='flagged',
-                            reason=reason,
-                            merged_data={}
-                        ))
-
-                        if i not in processed:
-                            processed.add(i)
-                        processed.add(j)
-
-        if i not in processed:
-            clean_records.append(record)
-            processed.add(i)
+    in_group = set()
+    for root, members in clusters.items():
+        if len(members) < 2:
+            continue
+        # Most complete first; the stable sort keeps row order on ties
+        ranked = [members[k] for k in np.argsort(-scores[members], kind="stable").tolist()]
+        master = records[ranked[0]]
+        dups = [records[k] for k in ranked[1:]]
+
+        group = DuplicateGroup(
+            master_record=master,
+            duplicates=dups,
+            merge_type='auto',
+            reason=cluster_reasons[root],
+            merged_data=merge_records(master, dups, cols)
+        )
+        duplicate_groups.append(group)
+        if on_group is not None:
+            on_group(group, features[ranked[0]], [features[k] for k in ranked[1:]])
+        in_group.update(members)
+
+    # One review pair per pair of clusters linked by a company conflict,
+    # from the first conflict between them
+    root_i, root_j = parent[flag_i], parent[flag_j]
+    linked = np.flatnonzero(root_i != root_j)
+    cluster_pairs = np.minimum(root_i[linked], root_j[linked]) * n + np.maximum(root_i[linked], root_j[linked])
+    _, first = np.unique(cluster_pairs, return_index=True)
+    for e in linked[np.sort(first)].tolist():
+        i, j = int(flag_i[e]), int(flag_j[e])
+        if e < n_direct:
+            company_a, company_b = features[i].company, features[j].company
+        else:
+            company_a, company_b = company_names[flag_a[e]], company_names[flag_b[e]]
+        reason = f"Different companies: {company_a} vs {company_b}"
+
+        master_idx, dup_idx = (i, j) if features[i].score >= features[j].score else (j, i)
+
+        group = DuplicateGroup(
+            master_record=records[master_idx],
+            duplicates=[records[dup_idx]],
+            merge_type='flagged',
+            reason=reason
+        )
+        duplicate_groups.append(group)
+        if on_group is not None:
+            on_group(group, features[master_idx], [features[dup_idx]])
+        in_group.update((i, j))
+
+    clean_records = [record for i, record in enumerate(records) if i not in in_group]
 
     return duplicate_groups, clean_records
 
 
+def iter_lines(text: str) -> Iterator[str]:
+    """
+    Yield the lines of text with their endings, without copying the whole
+    buffer. A leading byte order mark is skipped.
+    """
+    start = 1 if text.startswith('\ufeff') else 0
+    while start < len(text):
+        end = text.find("\n", start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end + 1]
+        start = end + 1
+
+
 def process_csv(csv_content: str) -> dict:
     """
     Process a CSV file and find duplicates.
@@ -328,9 +692,81 @@ def process_csv(csv_content: str) -> dict:
     - master_csv: Clean records + merged masters + flagged records (with _status column)
     - duplicates_csv: Records to delete from Attio
     """
-    reader = csv.DictReader(io.StringIO(csv_content))
-    records = list(reader)
-    fieldnames = reader.fieldnames or []
+    # Parse line by line; io.StringIO would hold a second, 4-byte-per-char
+    # copy of the upload for the whole run
+    return process_rows(csv.reader(iter_lines(csv_content)))
+
+
+def process_csv_stream(fileobj: BinaryIO, encoding: str = 'utf-8-sig') -> dict:
+    """
+    Process a CSV from a binary file object, decoding it as it is parsed.
+    With the default encoding a UTF-8 BOM (as written by Excel) is
+    dropped; undecodable bytes raise UnicodeDecodeError.
+    """
+    text = io.TextIOWrapper(fileobj, encoding=encoding, newline='')
+    try:
+        return process_rows(csv.reader(text))
+    finally:
+        # Leave the caller's file open
+        text.detach()
+
+
+# Tried in order; latin-1 maps every byte, so the last one always decodes
+CSV_ENCODINGS = ('utf-8-sig', 'cp1252', 'latin-1')
+
+
+def process_csv_file(path: str) -> dict:
+    """
+    Process a CSV file on disk; the entry point for worker processes.
+    Files that aren't valid UTF-8 (e.g. saved from Excel on Windows) are
+    re-read from disk as cp1252, then latin-1. The output CSVs come back
+    encoded, see encode_outputs.
+    """
+    # Read through a buffered file rather than mmap: iterating an mmap
+    # by lines only splits on "\n" (breaking "\r"-only files) and was no
+    # faster. The file also can't be cut into segments parsed in parallel,
+    # since a quoted field may contain newlines.
+    for encoding in CSV_ENCODINGS[:-1]:
+        try:
+            with open(path, 'rb') as f:
+                return encode_outputs(process_csv_stream(f, encoding))
+        except UnicodeDecodeError:
+            continue
+    with open(path, 'rb') as f:
+        return encode_outputs(process_csv_stream(f, CSV_ENCODINGS[-1]))
+
+
+def encode_csv(text: str) -> tuple[bytes, bytes]:
+    """Encode a CSV as UTF-8, plus a gzipped copy."""
+    data = text.encode('utf-8')
+    return data, gzip.compress(data, compresslevel=6)
+
+
+def encode_outputs(result: dict) -> dict:
+    """
+    Replace the output CSVs of a result with UTF-8 bytes and add gzipped
+    copies (master_csv_gz, duplicates_csv_gz). Done in the worker, so the
+    web process neither unpickles the text nor spends CPU compressing it.
+    """
+    keys = ('master_csv', 'duplicates_csv')
+    # One thread per CSV; zlib releases the GIL, so the two compress in parallel
+    with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+        encoded = list(executor.map(encode_csv, [result.pop(key) for key in keys]))
+    for key, (data, data_gz) in zip(keys, encoded):
+        result[key] = data
+        result[f'{key}_gz'] = data_gz
+    return result
+
+
+def process_rows(reader: Iterator[list[str]]) -> dict:
+    """Deduplicate the rows of a CSV reader whose first row is the header."""
+    fieldnames = next(reader, [])
+    width = len(fieldnames)
+    # Pad/truncate ragged rows to the header width, skipping blank lines
+    records = [
+        tuple(row[:width]) if len(row) >= width else tuple(row) + ("",) * (width - len(row))
+        for row in reader if row
+    ]
 
     if not records:
         return {
@@ -343,93 +779,59 @@ def process_csv(csv_content: str) -> dict:
             'duplicates_csv': ''
         }
 
-    duplicate_groups, clean_records = find_duplicates(records)
-
-    auto_merge_groups = [g for g in duplicate_groups if g.merge_type == 'auto']
-    flagged_groups = [g for g in duplicate_groups if g.merge_type == 'flagged']
+    cols = build_column_map(fieldnames)
 
-    # Build master CSV with status column
+    # Build master CSV (with status column), duplicates CSV (records to
+    # delete) and the summary in one sweep as groups are formed
     output_fieldnames = fieldnames + ['_status', '_note']
-    master_records = []
-
-    # Add clean records
-    for record in clean_records:
-        r = dict(record)
-        r['_status'] = 'clean'
-        r['_note'] = ''
-        master_records.append(r)
-
-    # Add merged masters
-    for group in auto_merge_groups:
-        r = dict(group.merged_data)
-        r['_status'] = 'merged'
-        r['_note'] = f'Merged {len(group.duplicates)} duplicate(s)'
-        master_records.append(r)
-
-    # Add flagged records (both sides, for user to review)
-    for group in flagged_groups:
-        r = dict(group.master_record)
-        r['_status'] = 'review'
-        r['_note'] = group.reason
-        master_records.append(r)
-
-        for dup in group.duplicates:
-            r = dict(dup)
-            r['_status'] = 'review'
-            r['_note'] = group.reason
-            master_records.append(r)
-
-    # Build duplicates CSV (records to delete)
     dup_fieldnames = fieldnames + ['_merged_into']
+    merged_rows = []
+    review_rows = []
     duplicates_to_delete = []
+    groups_summary = []
 
-    for group in auto_merge_groups:
-        master_name = get_name_field(group.master_record)
-        for dup in group.duplicates:
-            r = dict(dup)
-            r['_merged_into'] = master_name
-            duplicates_to_delete.append(r)
+    def emit_group(group: DuplicateGroup, master_feat: RecordFeatures, dup_feats: list[RecordFeatures]) -> None:
+        if group.merge_type == 'auto':
+            merged_rows.append([*group.merged_data, 'merged', f'Merged {len(group.duplicates)} duplicate(s)'])
+            for dup in group.duplicates:
+                duplicates_to_delete.append(dup + (master_feat.name,))
+        else:
+            # Flagged records go in on both sides, for user to review
+            review_rows.append(group.master_record + ('review', group.reason))
+            for dup in group.duplicates:
+                review_rows.append(dup + ('review', group.reason))
 
-    # Generate CSV strings
-    master_output = io.StringIO()
-    if master_records:
-        writer = csv.DictWriter(master_output, fieldnames=output_fieldnames, extrasaction='ignore')
-        writer.writeheader()
-        writer.writerows(master_records)
-    master_csv = master_output.getvalue()
-
-    duplicates_output = io.StringIO()
-    if duplicates_to_delete:
-        writer = csv.DictWriter(duplicates_output, fieldnames=dup_fieldnames, extrasaction='ignore')
-        writer.writeheader()
-        writer.writerows(duplicates_to_delete)
-    duplicates_csv = duplicates_output.getvalue()
-
-    # Build summary
-    groups_summary = []
-    for group in duplicate_groups:
         groups_summary.append({
-            'master_name': get_name_field(group.master_record),
-            'master_company': get_company_field(group.master_record),
-            'master_email': get_all_emails(group.master_record)[0] if get_all_emails(group.master_record) else '',
+            'master_name': master_feat.name,
+            'master_company': master_feat.company,
+            'master_email': master_feat.email,
             'duplicate_count': len(group.duplicates),
             'merge_type': group.merge_type,
             'reason': group.reason,
             'duplicates': [
-                {
-                    'name': get_name_field(d),
-                    'company': get_company_field(d),
-                    'email': get_all_emails(d)[0] if get_all_emails(d) else ''
-                }
-                for d in group.duplicates
+                {'name': d.name, 'company': d.company, 'email': d.email}
+                for d in dup_feats
             ]
         })
 
+    _, clean_records = find_duplicates(records, cols, on_group=emit_group)
+
+    master_records = [record + ('clean', '') for record in clean_records]
+    master_records.extend(merged_rows)
+    master_records.extend(review_rows)
+
+    # Generate CSV strings
+    master_csv = format_csv(output_fieldnames, master_records) if master_records else ''
+    duplicates_csv = format_csv(dup_fieldnames, duplicates_to_delete) if duplicates_to_delete else ''
+
+    # Emails don't repeat across uploads; release the parse cache
+    clear_email_cache()
+
     return {
         'total_records': len(records),
         'duplicate_groups': groups_summary,
-        'auto_merge_count': sum(len(g.duplicates) for g in auto_merge_groups),
-        'flagged_count': len(flagged_groups),  # Number of groups needing review
+        'auto_merge_count': len(duplicates_to_delete),
+        'flagged_count': len(groups_summary) - len(merged_rows),  # Number of groups needing review
         'clean_count': len(clean_records),
         'master_csv': master_csv,
         'duplicates_csv': duplicates_csv
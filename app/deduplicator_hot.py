@@ -0,0 +1,205 @@
+"""
+Per-record helpers for the deduplication engine.
+
+These are tight pure-Python loops over strings and rows, kept in their
+own fully annotated module so it can be compiled with mypyc:
+
+    mypyc app/deduplicator_hot.py
+
+The compiled extension is picked up by the same import; without it the
+module runs as plain Python.
+"""
+
+import functools
+import re
+from dataclasses import dataclass
+from typing import Final, Sequence
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# Registrable label followed by a TLD or a second-level suffix like .co.uk
+_DOMAIN_RE = re.compile(r"([a-z0-9-]+)\.(?:(?:co|com|org|net|ac|gov|edu)\.[a-z]{2}|[a-z]{2,})$")
+# Characters that force a CSV field to be quoted
+_CSV_SPECIAL_RE = re.compile(r'[",\r\n]')
+
+
+def normalize_name(name: str) -> str:
+    """Normalize a name for comparison."""
+    if not name:
+        return ""
+    return _WHITESPACE_RE.sub(" ", name.strip()).lower()
+
+
+def extract_email_parts(email: str) -> tuple[str, str]:
+    """
+    Extract username and domain base from email.
+    nacho@google.com -> ('nacho', 'google')
+    nacho@google.es -> ('nacho', 'google')
+    nacho@mail.google.co.uk -> ('nacho', 'google')
+    """
+    if not email or "@" not in email:
+        return ("", "")
+    return _split_email(email.lower().strip())
+
+
+@functools.lru_cache(maxsize=None)
+def _split_email(email: str) -> tuple[str, str]:
+    """Cached worker for extract_email_parts; expects a normalized email."""
+    parts = email.split("@")
+    if len(parts) != 2:
+        return ("", "")
+
+    username = parts[0]
+    domain = parts[1]
+
+    # Take the label right before the public suffix
+    # google.com -> google
+    # google.co.uk -> google
+    # mail.google.com -> google
+    match = _DOMAIN_RE.search(domain)
+    domain_base = match.group(1) if match else domain.split(".")[0]
+
+    return (username, domain_base)
+
+
+def clear_email_cache() -> None:
+    """Release the parsed-email cache between uploads."""
+    _split_email.cache_clear()
+
+
+# Completeness category of a CSV column. Plain int constants rather than
+# an IntEnum: mypyc 1.8 emits C for enum members that doesn't compile.
+KIND_EMAIL: Final = 1
+KIND_PHONE: Final = 2
+KIND_COMPANY: Final = 3
+KIND_TITLE: Final = 4
+KIND_LINKEDIN: Final = 5
+KIND_ADDRESS: Final = 6
+KIND_OTHER: Final = 7
+
+COLUMN_WEIGHTS: Final = {
+    KIND_EMAIL: 10,
+    KIND_PHONE: 5,
+    KIND_COMPANY: 5,
+    KIND_TITLE: 3,
+    KIND_LINKEDIN: 2,
+    KIND_ADDRESS: 2,
+    KIND_OTHER: 1,
+}
+
+NAME_KEYS = ['name', 'full_name', 'fullname', 'contact_name', 'person_name']
+COMPANY_KEYS = ['company', 'company_name', 'organization', 'org', 'employer']
+
+
+@dataclass
+class ColumnMap:
+    """Header classification by column position, computed once per CSV."""
+    fieldnames: list[str]
+    kinds: list[int]
+    email_cols: list[int]
+    name_col: int | None = None
+    first_name_col: int | None = None
+    last_name_col: int | None = None
+    company_col: int | None = None
+
+
+def classify_column(key: str) -> int:
+    """Classify a column header into its completeness category."""
+    key_lower = key.lower()
+    if 'email' in key_lower:
+        return KIND_EMAIL
+    if 'phone' in key_lower or 'mobile' in key_lower:
+        return KIND_PHONE
+    if 'company' in key_lower or 'organization' in key_lower:
+        return KIND_COMPANY
+    if 'title' in key_lower or 'job' in key_lower or 'position' in key_lower:
+        return KIND_TITLE
+    if 'linkedin' in key_lower:
+        return KIND_LINKEDIN
+    if 'address' in key_lower or 'location' in key_lower:
+        return KIND_ADDRESS
+    return KIND_OTHER
+
+
+def build_column_map(fieldnames: list[str]) -> ColumnMap:
+    """Classify every header once so record helpers can skip string scans."""
+    cols = ColumnMap(
+        fieldnames=list(fieldnames),
+        kinds=[classify_column(key) for key in fieldnames],
+        email_cols=[idx for idx, key in enumerate(fieldnames) if 'email' in key.lower()]
+    )
+    for idx, key in enumerate(fieldnames):
+        key_lower = key.lower()
+        if cols.name_col is None and key_lower in NAME_KEYS:
+            cols.name_col = idx
+        if cols.company_col is None and key_lower in COMPANY_KEYS:
+            cols.company_col = idx
+        if 'first' in key_lower and 'name' in key_lower:
+            cols.first_name_col = idx
+        elif 'last' in key_lower and 'name' in key_lower:
+            cols.last_name_col = idx
+    return cols
+
+
+def get_all_emails(record: tuple[str, ...], cols: ColumnMap) -> list[str]:
+    """Extract all email addresses from a record."""
+    emails = []
+    for idx in cols.email_cols:
+        value = record[idx]
+        if value and "@" in value:
+            emails.append(value.lower().strip())
+    return emails
+
+
+def signatures_from_emails(emails: list[str]) -> set[str]:
+    """Build 'username:domain' signatures from already extracted emails."""
+    signatures = set()
+    for email in emails:
+        username, domain = extract_email_parts(email)
+        if username and domain:
+            signatures.add(f"{username}:{domain}")
+    return signatures
+
+
+def get_name_field(record: tuple[str, ...], cols: ColumnMap) -> str:
+    """Find and return the name field from a record."""
+    if cols.name_col is not None:
+        return record[cols.name_col]
+    # Try to combine first + last name
+    first = record[cols.first_name_col] if cols.first_name_col is not None else ""
+    last = record[cols.last_name_col] if cols.last_name_col is not None else ""
+    if first or last:
+        return f"{first} {last}".strip()
+    return ""
+
+
+def get_company_field(record: tuple[str, ...], cols: ColumnMap) -> str:
+    """Find and return the company field from a record."""
+    if cols.company_col is not None:
+        return record[cols.company_col].strip()
+    return ""
+
+
+def csv_field(value: str) -> str:
+    """Quote a CSV field only when it needs it, like csv.QUOTE_MINIMAL."""
+    if _CSV_SPECIAL_RE.search(value):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def csv_line(row: Sequence[str]) -> str:
+    """Serialize one row; rows with no special characters skip per-field quoting."""
+    if _CSV_SPECIAL_RE.search("".join(row)):
+        return ",".join([csv_field(v) for v in row])
+    return ",".join(row)
+
+
+# Rows come out of matching row-wise, so a columnar writer such as
+# pyarrow.csv.write_csv has to transpose them first, and that transpose
+# alone costs more than joining the lines here.
+def format_csv(header: list[str], rows: Sequence[Sequence[str]]) -> str:
+    """Serialize a header and rows to CSV text with "\\n" line endings."""
+    lines = [csv_line(header)]
+    lines.extend([csv_line(row) for row in rows])
+    lines.append("")
+    return "\n".join(lines)
@@ -6,30 +6,69 @@ CSV Deduplication SaaS API
 - Download cleaned CSVs
 """
 
+import asyncio
+import contextlib
+import functools
+import hashlib
+import hmac
+import multiprocessing
 import os
-import uuid
-import json
-from datetime import datetime, timedelta
+import secrets
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
+import jinja2
+import orjson
 import stripe
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 
-from .deduplicator import process_csv
+from .deduplicator import process_csv_file, set_scoring_threads
+from .session_store import create_session_store
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Release the Stripe HTTP client and the worker pool on shutdown."""
+    yield
+    await stripe.default_http_client.close_async()
+    process_pool.shutdown(wait=False, cancel_futures=True)
+
 
 # Initialize FastAPI
 app = FastAPI(
     title="CSV Deduplicator",
-    description="Find and merge duplicate records in your CSV files"
+    description="Find and merge duplicate records in your CSV files",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Setup paths
 BASE_DIR = Path(__file__).resolve().parent.parent
-templates = Jinja2Templates(directory=BASE_DIR / "templates")
+# Templates don't change while the app runs: no reload checks, and
+# compiled bytecode is shared across workers and restarts
+templates = Jinja2Templates(env=jinja2.Environment(
+    loader=jinja2.FileSystemLoader(BASE_DIR / "templates"),
+    autoescape=True,
+    auto_reload=False,
+    bytecode_cache=jinja2.FileSystemBytecodeCache()
+))
+
+# The landing page has no per-request data; render it once
+LANDING_HTML = templates.get_template("index.html").render().encode('utf-8')
+LANDING_ETAG = f'"{hashlib.sha256(LANDING_HTML).hexdigest()}"'
+# Part of the results page ETag, so a deploy that changes the template
+# invalidates pages browsers have cached
+RESULTS_TEMPLATE_HASH = hashlib.sha256(
+    templates.env.loader.get_source(templates.env, "results.html")[0].encode('utf-8')
+).hexdigest()
 
 # Mount static files only if directory exists and has files
 static_dir = BASE_DIR / "static"
@@ -41,13 +80,48 @@ if static_dir.exists():
 
 # Stripe configuration
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY", "")
+# One httpx client for the process so connections to the API are kept
+# alive. Only the SDK's *_async methods are used, so no sync client (and
+# its connection pool) is created
+stripe.default_http_client = stripe.HTTPXClient(timeout=10)
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+STRIPE_WEBHOOK_TOLERANCE = 300  # Max age of a signed webhook, in seconds
 STRIPE_PRICE_PER_RECORD = 0.01  # €0.01 per record
 FREE_TIER_LIMIT = 250
 CURRENCY = "eur"
 
-# In-memory session storage (use Redis in production)
-sessions = {}
+# Duplicate groups kept in the session for the results preview
+PREVIEW_GROUPS = 20
+
+# Downloads are streamed in slices of this size
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Deduplication is CPU-bound; run it in worker processes so one upload
+# doesn't stall the event loop for every other client. Workers come from
+# a forkserver rather than forking this process with its event loop,
+# threads and sockets; the server preloads the deduplicator once.
+_mp_context = multiprocessing.get_context("forkserver")
+_mp_context.set_forkserver_preload(["app.deduplicator"])
+
+# Every web worker has its own pool, so keep both small: web workers x
+# pool workers x scoring threads should stay near the core count
+PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", "2"))
+SCORING_THREADS = int(os.getenv("SCORING_THREADS", "1"))
+
+
+def create_process_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=PROCESS_POOL_WORKERS,
+        mp_context=_mp_context,
+        initializer=set_scoring_threads,
+        initargs=(SCORING_THREADS,)
+    )
+
+
+process_pool = create_process_pool()
+
+# Session storage: Redis if REDIS_URL is set, in-memory otherwise
+sessions = create_session_store()
 
 # Base URL for redirects
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
@@ -64,69 +138,170 @@ class AnalysisResult(BaseModel):
     is_free_tier: bool
 
 
+_FREE_RESULT = (0, True)
+
+
+@functools.lru_cache(maxsize=1024)
 def calculate_price(total_records: int) -> tuple[int, bool]:
     """Calculate price in cents and whether it's free tier."""
     if total_records <= FREE_TIER_LIMIT:
-        return 0, True
+        return _FREE_RESULT
     billable_records = total_records
     price_cents = int(billable_records * STRIPE_PRICE_PER_RECORD * 100)
     return price_cents, False
 
 
+async def iter_chunks(data: bytes):
+    """Yield data in DOWNLOAD_CHUNK_SIZE slices."""
+    view = memoryview(data)
+    for start in range(0, len(view), DOWNLOAD_CHUNK_SIZE):
+        yield bytes(view[start:start + DOWNLOAD_CHUNK_SIZE])
+
+
+async def run_in_process_pool(fn, *args):
+    """Run fn in the worker pool, replacing the pool if a worker died."""
+    global process_pool
+    pool = process_pool
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        # A worker was killed (e.g. out of memory), which fails every job
+        # on the pool for good; the first caller to see it swaps in a new one
+        if process_pool is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            process_pool = create_process_pool()
+        raise
+
+
+def spool_upload(fileobj) -> str:
+    """Copy an upload to a temporary file and return its path."""
+    with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as f:
+        shutil.copyfileobj(fileobj, f, DOWNLOAD_CHUNK_SIZE)
+        return f.name
+
+
+@functools.lru_cache(maxsize=256)
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip (q-value above 0)."""
+    qvalues = {}
+    for item in accept_encoding.split(','):
+        coding, *params = item.split(';')
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding.strip().lower()] = q
+    # An explicit gzip entry overrides the wildcard
+    return qvalues.get('gzip', qvalues.get('*', 0.0)) > 0
+
+
+async def csv_response(request: Request, session_id: str, session: dict, name: str) -> StreamingResponse:
+    """Stream a stored CSV, gzipped if the client accepts it."""
+    headers = dict(session[f'{name}_headers'])
+    headers['Vary'] = 'Accept-Encoding'
+    if accepts_gzip(request.headers.get('accept-encoding', '')):
+        name = f'{name}_gz'
+        headers['Content-Encoding'] = 'gzip'
+
+    csv_content = await sessions.get_csv(session_id, name) or b''
+
+    return StreamingResponse(
+        iter_chunks(csv_content),
+        media_type="text/csv",
+        headers=headers
+    )
+
+
+def results_etag(session_id: str, session: dict) -> str:
+    """ETag for a session's results page."""
+    key = f"{RESULTS_TEMPLATE_HASH}:{session_id}:{session['paid']}:{session['result']['total_records']}"
+    return f'"{hashlib.sha256(key.encode()).hexdigest()}"'
+
+
 @app.get("/", response_class=HTMLResponse)
 async def landing_page(request: Request):
     """Serve the landing page."""
-    return templates.TemplateResponse("index.html", {"request": request})
+    if request.headers.get('if-none-match') == LANDING_ETAG:
+        return Response(status_code=304, headers={"ETag": LANDING_ETAG})
+
+    return HTMLResponse(LANDING_HTML, headers={"ETag": LANDING_ETAG})
 
 
 @app.post("/upload")
 async def upload_csv(file: UploadFile = File(...)):
     """Upload and analyze a CSV file."""
-    if not file.filename.endswith('.csv'):
+    # filename may be missing from the multipart part
+    if not (file.filename or '').lower().endswith('.csv'):
         raise HTTPException(status_code=400, detail="Please upload a CSV file")
 
-    # Read file content
-    content = await file.read()
-    try:
-        csv_content = content.decode('utf-8')
-    except UnicodeDecodeError:
-        try:
-            csv_content = content.decode('latin-1')
-        except:
-            raise HTTPException(status_code=400, detail="Could not decode CSV file")
-
-    # Process CSV
+    # Reject empty files before spooling them or starting a worker
+    if file.size == 0:
+        raise HTTPException(status_code=400, detail="The uploaded file is empty")
+
+    # Spool the upload to disk and hand the worker its path, rather than
+    # pickling the whole file across the pipe
+    upload_path = await run_in_threadpool(spool_upload, file.file)
     try:
-        result = process_csv(csv_content)
+        result = await run_in_process_pool(process_csv_file, upload_path)
+    except BrokenProcessPool:
+        raise HTTPException(status_code=503, detail="Processing failed, please try again")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing CSV: {str(e)}")
+    finally:
+        os.unlink(upload_path)
+
+    # The worker encoded and gzipped the CSVs once, rather than on every
+    # download; they are stored apart from the session so page views
+    # don't load them
+    csvs = {
+        'master': result.pop('master_csv'),
+        'master_gz': result.pop('master_csv_gz'),
+        'dups': result.pop('duplicates_csv'),
+        'dups_gz': result.pop('duplicates_csv_gz'),
+    }
+
+    # Keep only the preview; the full group list is already in the CSVs
+    duplicate_groups = result.pop('duplicate_groups')
+    result['duplicate_groups_preview'] = duplicate_groups[:PREVIEW_GROUPS]
+    result['duplicate_groups_total'] = len(duplicate_groups)
 
     # Calculate price
     price_cents, is_free_tier = calculate_price(result['total_records'])
+    price_display = f"€{price_cents / 100:.2f}" if price_cents > 0 else "Free"
 
     # Create session
-    session_id = str(uuid.uuid4())
-    sessions[session_id] = {
-        'created_at': datetime.utcnow().isoformat(),
-        'filename': file.filename,
-        'result': result,
-        'price_cents': price_cents,
-        'is_free_tier': is_free_tier,
-        'paid': is_free_tier,  # Free tier is auto-paid
-        'expires_at': (datetime.utcnow() + timedelta(hours=24)).isoformat()
-    }
+    session_id = secrets.token_urlsafe(16)
+    try:
+        await sessions.create(session_id, {
+            'created_at': time.time(),
+            'filename': file.filename,
+            'result': result,
+            'price_cents': price_cents,
+            'price_display': price_display,
+            'is_free_tier': is_free_tier,
+            'paid': is_free_tier,  # Free tier is auto-paid
+            # Download headers, built once as (key, value) pairs
+            'master_headers': (("Content-Disposition", f"attachment; filename=master_{file.filename}"),),
+            'dups_headers': (("Content-Disposition", f"attachment; filename=duplicates_to_delete_{file.filename}"),),
+        }, csvs)
+    except ValueError:
+        raise HTTPException(status_code=413, detail="The results are too large to store")
 
     return {
         'session_id': session_id,
         'filename': file.filename,
         'total_records': result['total_records'],
-        'duplicate_groups': result['duplicate_groups'][:20],  # Limit preview
-        'total_duplicate_groups': len(result['duplicate_groups']),
+        'duplicate_groups': result['duplicate_groups_preview'],
+        'total_duplicate_groups': result['duplicate_groups_total'],
         'auto_merge_count': result['auto_merge_count'],
         'flagged_count': result['flagged_count'],
         'clean_count': result['clean_count'],
         'price_cents': price_cents,
-        'price_display': f"€{price_cents / 100:.2f}" if price_cents > 0 else "Free",
+        'price_display': price_display,
         'is_free_tier': is_free_tier
     }
 
@@ -134,25 +309,29 @@ async def upload_csv(file: UploadFile = File(...)):
 @app.get("/results/{session_id}", response_class=HTMLResponse)
 async def results_page(request: Request, session_id: str):
     """Show analysis results page."""
-    if session_id not in sessions:
+    session = await sessions.get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    session = sessions[session_id]
+    # Only the paid flag changes once a session exists
+    etag = results_etag(session_id, session)
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
     return templates.TemplateResponse("results.html", {
         "request": request,
         "session_id": session_id,
         "session": session
-    })
+    }, headers={"ETag": etag})
 
 
 @app.post("/create-checkout/{session_id}")
 async def create_checkout(session_id: str):
     """Create a Stripe checkout session."""
-    if session_id not in sessions:
+    session = await sessions.get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    session = sessions[session_id]
-
     if session['is_free_tier']:
         return {"redirect_url": f"{BASE_URL}/download/{session_id}"}
 
@@ -163,7 +342,7 @@ async def create_checkout(session_id: str):
         raise HTTPException(status_code=500, detail="Stripe not configured")
 
     try:
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = await stripe.checkout.Session.create_async(
             payment_method_types=['card'],
             line_items=[{
                 'price_data': {
@@ -191,37 +370,72 @@ async def create_checkout(session_id: str):
 @app.get("/payment-success/{session_id}")
 async def payment_success(session_id: str):
     """Handle successful payment."""
-    if session_id not in sessions:
+    session = await sessions.get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
     # Mark as paid (in production, verify with webhook)
-    sessions[session_id]['paid'] = True
+    session['paid'] = True
+    await sessions.save(session_id, session)
 
     return RedirectResponse(url=f"/download/{session_id}")
 
 
+def verify_stripe_signature(payload: bytes, sig_header: str | None) -> None:
+    """
+    Check a Stripe-Signature header ("t=...,v1=...") against the raw body,
+    as stripe.Webhook.construct_event does, without building an event object.
+    """
+    timestamp = None
+    signatures = []
+    for item in (sig_header or '').split(','):
+        key, _, value = item.strip().partition('=')
+        if key == 't':
+            timestamp = value
+        elif key == 'v1':
+            signatures.append(value)
+
+    if not timestamp or not timestamp.isdigit() or not signatures:
+        raise ValueError("Invalid signature header")
+
+    expected = hmac.new(
+        STRIPE_WEBHOOK_SECRET.encode(), timestamp.encode() + b'.' + payload, hashlib.sha256
+    ).hexdigest()
+    # Compared as bytes: compare_digest raises TypeError on non-ASCII str.
+    # Header values arrive decoded as latin-1
+    if not any(hmac.compare_digest(expected.encode(), sig.encode('latin-1')) for sig in signatures):
+        raise ValueError("No signatures found matching the expected signature")
+    if abs(time.time() - int(timestamp)) > STRIPE_WEBHOOK_TOLERANCE:
+        raise ValueError("Timestamp outside the tolerance zone")
+
+
 @app.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
     """Handle Stripe webhooks."""
     payload = await request.body()
     sig_header = request.headers.get('stripe-signature')
 
-    if not STRIPE_WEBHOOK_SECRET:
-        # No webhook secret configured, skip verification
-        event = json.loads(payload)
-    else:
-        try:
-            event = stripe.Webhook.construct_event(
-                payload, sig_header, STRIPE_WEBHOOK_SECRET
-            )
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Webhook error: {str(e)}")
-
-    if event['type'] == 'checkout.session.completed':
-        checkout_session = event['data']['object']
-        session_id = checkout_session.get('metadata', {}).get('session_id')
-        if session_id and session_id in sessions:
-            sessions[session_id]['paid'] = True
+    try:
+        # Verification is skipped when no webhook secret is configured
+        if STRIPE_WEBHOOK_SECRET:
+            verify_stripe_signature(payload, sig_header)
+        # orjson.JSONDecodeError is a ValueError too
+        event = orjson.loads(payload)
+        if not isinstance(event, dict):
+            raise ValueError("Payload is not a JSON object")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Webhook error: {str(e)}")
+
+    if event.get('type') == 'checkout.session.completed':
+        # Unverified bodies can have any shape, and metadata may be null
+        data = event.get('data')
+        checkout_session = data.get('object') if isinstance(data, dict) else None
+        metadata = checkout_session.get('metadata') if isinstance(checkout_session, dict) else None
+        session_id = metadata.get('session_id') if isinstance(metadata, dict) else None
+        session = await sessions.get(session_id) if isinstance(session_id, str) and session_id else None
+        if session is not None:
+            session['paid'] = True
+            await sessions.save(session_id, session)
 
     return {"status": "ok"}
 
@@ -229,11 +443,10 @@ async def stripe_webhook(request: Request):
 @app.get("/download/{session_id}", response_class=HTMLResponse)
 async def download_page(request: Request, session_id: str):
     """Download page after payment."""
-    if session_id not in sessions:
+    session = await sessions.get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    session = sessions[session_id]
-
     if not session['paid']:
         return RedirectResponse(url=f"/results/{session_id}")
 
@@ -245,45 +458,29 @@ async def download_page(request: Request, session_id: str):
 
 
 @app.get("/download/{session_id}/master.csv")
-async def download_master_csv(session_id: str):
+async def download_master_csv(request: Request, session_id: str):
     """Download the master CSV with merged records."""
-    if session_id not in sessions:
+    session = await sessions.get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    session = sessions[session_id]
-
     if not session['paid']:
         raise HTTPException(status_code=403, detail="Payment required")
 
-    csv_content = session['result']['master_csv']
-    filename = f"master_{session['filename']}"
-
-    return StreamingResponse(
-        iter([csv_content]),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return await csv_response(request, session_id, session, 'master')
 
 
 @app.get("/download/{session_id}/duplicates.csv")
-async def download_duplicates_csv(session_id: str):
+async def download_duplicates_csv(request: Request, session_id: str):
     """Download the duplicates CSV (records to delete)."""
-    if session_id not in sessions:
+    session = await sessions.get(session_id)
+    if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    session = sessions[session_id]
-
     if not session['paid']:
         raise HTTPException(status_code=403, detail="Payment required")
 
-    csv_content = session['result']['duplicates_csv']
-    filename = f"duplicates_to_delete_{session['filename']}"
-
-    return StreamingResponse(
-        iter([csv_content]),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return await csv_response(request, session_id, session, 'dups')
 
 
 @app.get("/health")
@@ -298,4 +495,13 @@ async def health_check():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # uvloop/httptools come with uvicorn[standard]; multiple workers need
+    # the app as an import string
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    )
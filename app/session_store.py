@@ -0,0 +1,92 @@
+"""
+Session storage
+- Redis when REDIS_URL is set (shared across workers, expires via TTL)
+- In-process TTL cache otherwise (single worker / local development)
+
+Session metadata and the output CSVs are stored under separate keys so
+page views and status checks don't pull the CSV payloads.
+"""
+
+import os
+
+from cachetools import TTLCache
+
+SESSION_TTL_SECONDS = 24 * 60 * 60
+# Memory budget for in-process sessions, counted as the bytes of their
+# stored CSVs plus a flat allowance per session for the metadata
+MAX_SESSION_BYTES = int(os.getenv("MAX_SESSION_BYTES", 1024 * 1024 * 1024))
+SESSION_OVERHEAD_BYTES = 4 * 1024
+
+
+def entry_size(entry: tuple[dict, dict[str, bytes]]) -> int:
+    """Approximate memory held by a (session, csvs) entry, in bytes."""
+    return SESSION_OVERHEAD_BYTES + sum(map(len, entry[1].values()))
+
+
+class MemorySessionStore:
+    """
+    Sessions held in this process, bounded to MAX_SESSION_BYTES and
+    expiring after SESSION_TTL_SECONDS (oldest evicted first when full).
+    """
+
+    def __init__(self):
+        # session_id -> (session, csvs)
+        self._entries: TTLCache = TTLCache(
+            maxsize=MAX_SESSION_BYTES, ttl=SESSION_TTL_SECONDS, getsizeof=entry_size
+        )
+
+    async def create(self, session_id: str, session: dict, csvs: dict[str, bytes]) -> None:
+        # Raises ValueError if this one session exceeds the whole budget
+        self._entries[session_id] = (session, csvs)
+
+    async def get(self, session_id: str) -> dict | None:
+        entry = self._entries.get(session_id)
+        return entry[0] if entry is not None else None
+
+    async def save(self, session_id: str, session: dict) -> None:
+        # Update in place; reassigning the key would restart its TTL
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            entry[0].update(session)
+
+    async def get_csv(self, session_id: str, name: str) -> bytes | None:
+        entry = self._entries.get(session_id)
+        return entry[1].get(name) if entry is not None else None
+
+
+class RedisSessionStore:
+    """Sessions in Redis as msgpack blobs, expiring after SESSION_TTL_SECONDS."""
+
+    def __init__(self, url: str):
+        import msgpack
+        import redis.asyncio as redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._pack = msgpack.packb
+        self._unpack = msgpack.unpackb
+
+    async def create(self, session_id: str, session: dict, csvs: dict[str, bytes]) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.set(f"sess:{session_id}", self._pack(session), ex=SESSION_TTL_SECONDS)
+            for name, data in csvs.items():
+                pipe.set(f"sess:{session_id}:{name}", data, ex=SESSION_TTL_SECONDS)
+            await pipe.execute()
+
+    async def get(self, session_id: str) -> dict | None:
+        data = await self._redis.get(f"sess:{session_id}")
+        return self._unpack(data) if data is not None else None
+
+    async def save(self, session_id: str, session: dict) -> None:
+        # Only overwrite live sessions, keeping their original expiry
+        await self._redis.set(f"sess:{session_id}", self._pack(session), xx=True, keepttl=True)
+
+    async def get_csv(self, session_id: str, name: str) -> bytes | None:
+        return await self._redis.get(f"sess:{session_id}:{name}")
+
+
+def create_session_store() -> MemorySessionStore | RedisSessionStore:
+    """Pick the session store from the environment."""
+    url = os.getenv("REDIS_URL")
+    if url:
+        return RedisSessionStore(url)
+    return MemorySessionStore()
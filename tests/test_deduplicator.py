@@ -0,0 +1,168 @@
+import gzip
+import itertools
+import random
+import tracemalloc
+
+import numpy as np
+from rapidfuzz import fuzz
+
+from app import deduplicator
+from app.deduplicator import (
+    indel_within, match_name_bucket, match_names, normalize_name, process_csv, process_csv_file
+)
+
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz éüñøß李"
+
+
+def random_name(rng: random.Random) -> str:
+    """A name of 1 to 14 words, so lengths run from a few chars to over 64."""
+    words = ("".join(rng.choices(ALPHABET[:26], k=rng.randint(2, 9))) for _ in range(rng.randint(1, 14)))
+    return " ".join(words)
+
+
+def mutate(rng: random.Random, name: str) -> str:
+    """Apply 1-3 random substitutions, insertions or deletions."""
+    chars = list(name)
+    for _ in range(rng.randint(1, 3)):
+        k = rng.randrange(len(chars))
+        op = rng.random()
+        if op < 0.4:
+            chars[k] = rng.choice(ALPHABET)
+        elif op < 0.7:
+            chars.insert(k, rng.choice(ALPHABET))
+        elif len(chars) > 1:
+            del chars[k]
+    return "".join(chars)
+
+
+def names_match(a: str, b: str, threshold: int = 85) -> bool:
+    """Reference rule: fuzz.ratio, with 95 needed when either name is under 10 chars."""
+    return fuzz.ratio(a, b) >= (95 if min(len(a), len(b)) < 10 else threshold)
+
+
+def test_shared_name_rows_link_in_linear_memory():
+    # 20k rows on a placeholder name: expanding every pair would need ~1.6 GB
+    rows = "".join(f"Unknown,u{i}@d{i}.com,\n" for i in range(20000))
+    tracemalloc.start()
+    try:
+        result = process_csv("name,email,company\n" + rows)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert result['auto_merge_count'] == 19999
+    assert len(result['duplicate_groups']) == 1
+    assert peak < 256 * 1024 * 1024
+
+
+def test_shared_name_across_companies_is_flagged_once_per_company_pair():
+    rows = "".join(f"Unknown,u{i}@d{i}.com,Co{i % 5}\n" for i in range(2000))
+    result = process_csv("name,email,company\n" + rows)
+
+    # Each company merges on its own; the 5 clusters are flagged pairwise
+    assert result['auto_merge_count'] == 1995
+    assert result['flagged_count'] == 10
+    assert result['clean_count'] == 0
+
+
+def test_conflict_through_no_company_row_is_flagged():
+    # The no-company row joins Acme first, so linking it to Globex is refused
+    result = process_csv(
+        "name,email,company\n"
+        "Jane Doe,jane@acme.com,Acme\n"
+        "Jane Doe,jane@gmail.com,\n"
+        "Jane Doe,jane@globex.com,Globex\n"
+    )
+
+    assert result['auto_merge_count'] == 1
+    assert result['flagged_count'] == 1
+    flagged = [g for g in result['duplicate_groups'] if g['merge_type'] == 'flagged']
+    assert flagged[0]['reason'] == "Different companies: Acme vs Globex"
+
+
+def test_threaded_scoring_matches_single_thread(monkeypatch):
+    rng = random.Random(3)
+    syllables = ["an", "ber", "cal", "dor", "el", "fi", "gar", "is", "jo", "ka", "mar", "ri"]
+    rows = []
+    for _ in range(3000):
+        name = " ".join("".join(rng.choices(syllables, k=rng.randint(2, 3))) for _ in range(2))
+        if rng.random() < 0.3:
+            name = name[:-1] + rng.choice("aeiou")
+        rows.append(f"{name},,\n")
+    csv_content = "name,email,company\n" + "".join(rows)
+
+    monkeypatch.setattr(deduplicator, "SCORING_THREADS", 1)
+    single = process_csv(csv_content)
+    monkeypatch.setattr(deduplicator, "SCORING_THREADS", 4)
+    monkeypatch.setattr(deduplicator, "PARALLEL_PAIR_SLICE", 64)
+    threaded = process_csv(csv_content)
+
+    assert single['auto_merge_count'] > 0
+    assert threaded == single
+
+
+def test_indel_within_agrees_with_fuzz_ratio():
+    rng = random.Random(5)
+    names = []
+    for _ in range(3000):
+        name = random_name(rng)
+        names.extend([name, mutate(rng, name)])
+    names.extend(["person 1", "person 10", "josé", "jose", "zoë", "zoe", "a" * 70, "a" * 69 + "b"])
+    pairs = [(k, k + 1) for k in range(0, len(names), 2)]
+    pairs += [(rng.randrange(len(names)), rng.randrange(len(names))) for _ in range(3000)]
+    pairs.sort()
+
+    # Encode the strings the way match_names does
+    lengths = np.array([len(name) for name in names], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    codes = np.frombuffer("".join(names).encode("utf-32-le"), dtype=np.uint32)
+    char_set, chars = np.unique(codes, return_inverse=True)
+    left, right = (np.array(side, dtype=np.int64) for side in zip(*pairs))
+
+    assert lengths.max() > 64
+    for threshold in (85, 95):
+        pair_threshold = np.where(np.minimum(lengths[left], lengths[right]) < 10, 95, threshold)
+        max_dist = (lengths[left] + lengths[right]) * (100 - pair_threshold) // 100
+        within = indel_within(chars, len(char_set), offsets, left, right, max_dist)
+        expected = [names_match(names[a], names[b], threshold) for a, b in pairs]
+        assert within.tolist() == expected
+
+
+def test_match_name_bucket_applies_short_name_rule():
+    names = ["person 1", "person 10", "person 2", "jon smith", "john smith", "jonathan smithers", "jonathan smithres"]
+    expected = [(a, b) for a, b in itertools.combinations(range(len(names)), 2) if names_match(names[a], names[b])]
+
+    assert sorted(match_name_bucket(names, workers=1)) == expected
+    assert (0, 1) not in expected
+
+
+def test_lsh_blocking_recall_against_brute_force():
+    rng = random.Random(11)
+    names = set()
+    for _ in range(400):
+        name = random_name(rng)
+        names.add(name)
+        names.update(normalize_name(mutate(rng, name)) for _ in range(rng.randint(0, 3)))
+    names = sorted(name for name in names if name)
+
+    truth = {
+        (a, b) for a, b in itertools.combinations(range(len(names)), 2) if names_match(names[a], names[b])
+    }
+    match_i, match_j = match_names(names)
+    found = set(zip(match_i.tolist(), match_j.tolist()))
+
+    assert found <= truth
+    assert len(found) >= 0.97 * len(truth)
+
+
+def test_process_csv_file_returns_encoded_outputs(tmp_path):
+    path = tmp_path / "contacts.csv"
+    path.write_bytes("name,email,company\nJosé Pérez,jose@acme.com,Acme\nJose Perez,jose@acme.es,\n".encode("cp1252"))
+
+    result = process_csv_file(str(path))
+
+    assert result['auto_merge_count'] == 1
+    assert "José Pérez" in result['master_csv'].decode("utf-8")
+    assert gzip.decompress(result['master_csv_gz']) == result['master_csv']
+    assert gzip.decompress(result['duplicates_csv_gz']) == result['duplicates_csv']
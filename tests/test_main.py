@@ -0,0 +1,206 @@
+import asyncio
+import gzip
+import hashlib
+import hmac
+import time
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main, session_store
+
+WEBHOOK_SECRET = "whsec_test"
+
+CONTACTS_CSV = (
+    "name,email,company\n"
+    "Jane Doe,jane@acme.com,Acme\n"
+    "Jane Doe,jane@acme.es,\n"
+    "John Smith,john@globex.com,Globex\n"
+).encode()
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def upload(client: TestClient, content: bytes = CONTACTS_CSV) -> dict:
+    response = client.post("/upload", files={'file': ("contacts.csv", content, "text/csv")})
+    assert response.status_code == 200
+    return response.json()
+
+
+def create_session(session_id: str, **fields) -> None:
+    session = {'paid': False, 'result': {'total_records': 300}, **fields}
+    asyncio.run(main.sessions.create(session_id, session, {}))
+
+
+def stripe_signature(payload: bytes, timestamp: int | None = None, secret: str = WEBHOOK_SECRET) -> str:
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def post_webhook(client: TestClient, payload: bytes, signature: str | bytes | None = None):
+    headers = {'stripe-signature': signature} if signature is not None else {}
+    return client.post("/webhook/stripe", content=payload, headers=headers)
+
+
+def checkout_completed(session_id: str) -> bytes:
+    return orjson.dumps({
+        'type': 'checkout.session.completed',
+        'data': {'object': {'metadata': {'session_id': session_id}}},
+    })
+
+
+@pytest.fixture
+def webhook_secret(monkeypatch):
+    monkeypatch.setattr(main, "STRIPE_WEBHOOK_SECRET", WEBHOOK_SECRET)
+
+
+def test_webhook_valid_signature_marks_session_paid(client, webhook_secret):
+    create_session("webhook-valid")
+    payload = checkout_completed("webhook-valid")
+
+    response = post_webhook(client, payload, stripe_signature(payload))
+
+    assert response.status_code == 200
+    assert asyncio.run(main.sessions.get("webhook-valid"))['paid'] is True
+
+
+def test_webhook_wrong_signature_is_rejected(client, webhook_secret):
+    create_session("webhook-wrong")
+    payload = checkout_completed("webhook-wrong")
+
+    response = post_webhook(client, payload, stripe_signature(payload, secret="whsec_other"))
+
+    assert response.status_code == 400
+    assert asyncio.run(main.sessions.get("webhook-wrong"))['paid'] is False
+
+
+def test_webhook_stale_timestamp_is_rejected(client, webhook_secret):
+    payload = checkout_completed("webhook-stale")
+    stale = int(time.time()) - main.STRIPE_WEBHOOK_TOLERANCE - 60
+
+    assert post_webhook(client, payload, stripe_signature(payload, stale)).status_code == 400
+
+
+@pytest.mark.parametrize("signature", [None, "", "garbage", "t=abc,v1=00", "t=123", "v1=00"])
+def test_webhook_missing_or_garbled_header_is_rejected(client, webhook_secret, signature):
+    assert post_webhook(client, b'{"type": "ping"}', signature).status_code == 400
+
+
+def test_webhook_non_ascii_signature_is_rejected(client, webhook_secret):
+    payload = b'{"type": "ping"}'
+    # Sent as raw UTF-8 bytes; the server decodes header values as latin-1
+    signature = f"t={int(time.time())},v1=éabc".encode()
+
+    assert post_webhook(client, payload, signature).status_code == 400
+
+
+def test_webhook_accepts_any_matching_v1_entry(client, webhook_secret):
+    payload = b'{"type": "ping"}'
+    signature = stripe_signature(payload)
+    timestamp, valid = signature.split(',')
+
+    assert post_webhook(client, payload, f"{timestamp},v1={'0' * 64},{valid}").status_code == 200
+    assert post_webhook(client, payload, f"{timestamp},v1={'0' * 64},v0=abc").status_code == 400
+
+
+def test_webhook_non_object_body_is_rejected(client, webhook_secret):
+    for payload in (b'[]', b'"event"', b'not json'):
+        assert post_webhook(client, payload, stripe_signature(payload)).status_code == 400
+
+
+@pytest.mark.parametrize("event", [
+    {},
+    {'type': 'checkout.session.completed'},
+    {'type': 'checkout.session.completed', 'data': None},
+    {'type': 'checkout.session.completed', 'data': {'object': {'metadata': None}}},
+    {'type': 'checkout.session.completed', 'data': {'object': {'metadata': {'session_id': 42}}}},
+])
+def test_webhook_incomplete_events_are_ignored(client, event):
+    # No secret configured: unsigned bodies of any shape are accepted
+    assert post_webhook(client, orjson.dumps(event)).status_code == 200
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", True),
+    ("gzip, deflate, br", True),
+    ("GZIP;q=0.5", True),
+    ("gzip;q=0", False),
+    ("gzip;q=0.0, *;q=1", False),
+    ("*;q=0.5", True),
+    ("*;q=0", False),
+    ("identity", False),
+    ("deflate, identity;q=0.5", False),
+    ("gzip;q=abc", False),
+    ("", False),
+])
+def test_accepts_gzip(header, expected):
+    assert main.accepts_gzip(header) is expected
+
+
+def test_download_is_gzipped_only_when_accepted(client):
+    session_id = upload(client)['session_id']
+    url = f"/download/{session_id}/master.csv"
+
+    gzipped = client.get(url, headers={'accept-encoding': 'gzip'})
+    plain = client.get(url, headers={'accept-encoding': 'identity'})
+
+    assert gzipped.headers['content-encoding'] == 'gzip'
+    assert gzipped.headers['vary'] == 'Accept-Encoding'
+    assert 'content-encoding' not in plain.headers
+    assert plain.headers['vary'] == 'Accept-Encoding'
+    assert plain.headers['content-disposition'] == "attachment; filename=master_contacts.csv"
+    assert plain.content.startswith(b"name,email,company,_status,_note\n")
+    # httpx decodes gzip transparently; check the bytes on the wire too
+    assert gzipped.content == plain.content
+    with client.stream("GET", url, headers={'accept-encoding': 'gzip'}) as response:
+        assert gzip.decompress(b"".join(response.iter_raw())) == plain.content
+
+
+def test_landing_page_answers_matching_etag_with_304(client):
+    etag = client.get("/").headers['etag']
+
+    response = client.get("/", headers={'if-none-match': etag})
+
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+    assert client.get("/", headers={'if-none-match': '"stale"'}).status_code == 200
+
+
+def test_results_page_answers_matching_etag_with_304(client):
+    session_id = upload(client)['session_id']
+    url = f"/results/{session_id}"
+    etag = client.get(url).headers['etag']
+
+    response = client.get(url, headers={'if-none-match': etag})
+
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+
+
+def test_results_etag_changes_when_paid_flips(client):
+    session_id = upload(client)['session_id']
+    url = f"/results/{session_id}"
+    etag = client.get(url).headers['etag']
+
+    session = asyncio.run(main.sessions.get(session_id))
+    session['paid'] = not session['paid']
+    asyncio.run(main.sessions.save(session_id, session))
+
+    response = client.get(url, headers={'if-none-match': etag})
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+
+
+def test_results_too_large_to_store_get_413(client, monkeypatch):
+    monkeypatch.setattr(session_store, "MAX_SESSION_BYTES", session_store.SESSION_OVERHEAD_BYTES + 10)
+    monkeypatch.setattr(main, "sessions", session_store.MemorySessionStore())
+
+    response = client.post("/upload", files={'file': ("contacts.csv", CONTACTS_CSV, "text/csv")})
+
+    assert response.status_code == 413
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from app import session_store
+from app.session_store import SESSION_OVERHEAD_BYTES, MemorySessionStore
+
+
+@pytest.fixture
+def small_store(monkeypatch):
+    # Room for two sessions with 1 KB of CSVs each
+    monkeypatch.setattr(session_store, "MAX_SESSION_BYTES", 2 * (SESSION_OVERHEAD_BYTES + 1024) + 100)
+    return MemorySessionStore()
+
+
+def create(store: MemorySessionStore, session_id: str, csv_bytes: int) -> None:
+    asyncio.run(store.create(session_id, {'paid': False}, {'master': b"x" * csv_bytes}))
+
+
+def test_oldest_session_is_evicted_when_the_budget_is_full(small_store):
+    for session_id in ("first", "second", "third"):
+        create(small_store, session_id, 1024)
+
+    assert asyncio.run(small_store.get("first")) is None
+    assert asyncio.run(small_store.get("second")) == {'paid': False}
+    assert asyncio.run(small_store.get_csv("third", "master")) == b"x" * 1024
+
+
+def test_session_larger_than_the_budget_is_rejected(small_store):
+    create(small_store, "kept", 1024)
+
+    with pytest.raises(ValueError):
+        create(small_store, "huge", 4 * 1024 * 1024)
+
+    assert asyncio.run(small_store.get("huge")) is None
+    assert asyncio.run(small_store.get("kept")) == {'paid': False}
+
+
+def test_save_updates_a_session_in_place(small_store):
+    create(small_store, "session", 10)
+
+    asyncio.run(small_store.save("session", {'paid': True}))
+    asyncio.run(small_store.save("missing", {'paid': True}))
+
+    assert asyncio.run(small_store.get("session")) == {'paid': True}
+    assert asyncio.run(small_store.get("missing")) is None